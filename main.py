@@ -1,53 +1,75 @@
 import os
 import uuid
 from typing import List, Optional
+from decimal import Decimal
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, EmailStr
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, JSON
-from sqlalchemy.orm import sessionmaker, Session, declarative_base
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from sqlalchemy import event, select, bindparam, inspect, text, Column, Integer, String, DateTime, Text
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime
-import yookassa
+import httpx
+import orjson
 from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import logging
+from pythonjsonlogger import jsonlogger
+import asyncio
 import ipaddress
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+import bisect
+import html
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Настройка логирования: записи в JSON, уровень задается через LOG_LEVEL
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(jsonlogger.JsonFormatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[log_handler])
+logger = logging.getLogger(__name__)
+
 # Получение порта из переменной окружения
 PORT = int(os.getenv("PORT", 10000))
 
-# Настройка сессии requests для ЮKassa
-session = requests.Session()
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=0.5,
-    status_forcelist=[500, 502, 503, 504]
-)
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("https://", adapter)
-
 # Настройка ЮKassa
-yookassa.Configuration.configure(
-    account_id=os.getenv('YOOKASSA_SHOP_ID'),
-    secret_key=os.getenv('YOOKASSA_API_KEY'),
-    session=session
+YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
+YOOKASSA_API_KEY = os.getenv('YOOKASSA_API_KEY')
+YOOKASSA_API_URL = "https://api.yookassa.ru/v3/"
+# Повтор запросов при ответах 5xx с экспоненциальной задержкой 0.5, 1, 2 с
+YOOKASSA_RETRY_STATUSES = {500, 502, 503, 504}
+YOOKASSA_MAX_RETRIES = 3
+YOOKASSA_BACKOFF_FACTOR = 0.5
+# Тело запроса на создание платежа: подставляются только сумма и номер заказа.
+# Оба значения формируются сервером, поэтому экранирование JSON не требуется
+YOOKASSA_PAYMENT_TEMPLATE = (
+    '{{"amount":{{"value":"{value}","currency":"RUB"}},'
+    '"confirmation":{{"type":"embedded"}},'
+    '"capture":true,'
+    '"description":"Заказ №{order_id}"}}'
 )
 
 # Настройка Telegram
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+# Не больше 25 сообщений в секунду при лимите Telegram в 30
+TELEGRAM_SEND_INTERVAL = 1 / 25
+# Пауза между попытками, пока Telegram недоступен, растет до TELEGRAM_MAX_BACKOFF секунд
+TELEGRAM_MAX_BACKOFF = 60
+# Сколько секунд при остановке ждать отправки уже поставленных в очередь сообщений
+TELEGRAM_SHUTDOWN_TIMEOUT = 10
+# Сообщения в один чат, пришедшие в пределах окна, отправляются одним сообщением
+TELEGRAM_BATCH_WINDOW = 0.5
+TELEGRAM_BATCH_SIZE = 10
+TELEGRAM_BATCH_SEPARATOR = "\n---\n"
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
 
 # Список разрешенных IP-адресов ЮKassa
 YOOKASSA_IPS = [
@@ -60,12 +82,60 @@ YOOKASSA_IPS = [
     ipaddress.ip_network('2a02:5180::/32')
 ]
 
+# Диапазоны ЮKassa в виде отсортированных пар (первый, последний адрес) для поиска через bisect
+_YOOKASSA_RANGES = {
+    version: sorted(
+        (int(network.network_address), int(network.broadcast_address))
+        for network in YOOKASSA_IPS if network.version == version
+    )
+    for version in (4, 6)
+}
+_YOOKASSA_RANGE_STARTS = {
+    version: [start for start, _ in ranges]
+    for version, ranges in _YOOKASSA_RANGES.items()
+}
+
 # Настройка базы данных
-SQLALCHEMY_DATABASE_URL = "sqlite:///./orders.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./orders.db"
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"timeout": 30},
+    # Для файловой SQLite диалект aiosqlite по умолчанию выбирает NullPool
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=20,
+    max_overflow=40,
+    pool_recycle=1800,
+    pool_pre_ping=True,
+    echo=os.getenv("SQLALCHEMY_ECHO") == "1"
+)
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    # WAL позволяет читать статус заказа, не блокируя запись, а synchronous=NORMAL
+    # убирает fsync на каждый commit
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+# expire_on_commit=False: после commit объекты не перечитываются из БД лишним SELECT
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+class ORJSON(TypeDecorator):
+    """JSON-колонка, сериализуемая через orjson вместо стандартного json"""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else orjson.dumps(value).decode()
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else orjson.loads(value)
+
 # Модель заказа для базы данных
 class Order(Base):
     __tablename__ = "orders"
@@ -76,24 +146,43 @@ class Order(Base):
     address = Column(String)
     delivery_time = Column(String)
     order_time = Column(String)
-    items = Column(JSON)
-    total_amount = Column(Float)
+    items = Column(ORJSON)
+    total_amount_kop = Column(Integer, nullable=False)
     status = Column(String, default="created")
-    payment_id = Column(String, nullable=True)
+    payment_id = Column(String, nullable=True, index=True, unique=True)
+
+# Запрос поиска заказа по ID платежа строится один раз и переиспользуется в webhook
+GET_ORDER_BY_PAYMENT = select(Order).where(Order.payment_id == bindparam("pid")).limit(1)
+
+def _migrate_orders_schema(connection):
+    """Приводит таблицу orders, созданную прежними версиями, к текущей схеме.
+
+    create_all не меняет уже существующие таблицы, поэтому изменения схемы
+    применяются здесь; каждый шаг можно безопасно выполнять повторно.
+    """
+    columns = {column["name"] for column in inspect(connection).get_columns("orders")}
 
-Base.metadata.create_all(bind=engine)
+    # Суммы старых заказов переносятся из total_amount (Float) в копейки
+    if "total_amount_kop" not in columns:
+        connection.execute(text("ALTER TABLE orders ADD COLUMN total_amount_kop INTEGER"))
+        connection.execute(text(
+            "UPDATE orders SET total_amount_kop = CAST(ROUND(total_amount * 100) AS INTEGER)"
+        ))
+
+    # Индекс для поиска заказа по ID платежа в webhook
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_orders_payment_id ON orders (payment_id)"
+    ))
+
+def format_kopecks(amount_kop: int) -> str:
+    """Форматирует сумму в копейках как рубли с двумя знаками после точки"""
+    return f"{amount_kop // 100}.{amount_kop % 100:02d}"
 
 # Pydantic модели
 class OrderItem(BaseModel):
     name: str
     quantity: int
 
-    def dict(self, *args, **kwargs):
-        return {
-            "name": self.name,
-            "quantity": self.quantity
-        }
-
 class OrderCreate(BaseModel):
     email: EmailStr
     phone: str
@@ -101,50 +190,197 @@ class OrderCreate(BaseModel):
     delivery_time: str
     order_time: str
     items: List[OrderItem]
-    total_amount: float
+    total_amount: Decimal = Field(gt=0, max_digits=12, decimal_places=2)
+
+    @property
+    def total_amount_kop(self) -> int:
+        return int(self.total_amount * 100)
+
+class YooKassaPaymentObject(BaseModel):
+    id: str
+    status: Optional[str] = None
 
 class YooKassaNotification(BaseModel):
     type: str
     event: str
-    object: dict
+    object: YooKassaPaymentObject
 
 # Dependency для получения сессии БД
 async def get_db():
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+# Пул заранее сгенерированных UUID4: один вызов os.urandom на UUID_BATCH_SIZE ключей
+UUID_BATCH_SIZE = 1024
+uuid_queue = None
+
+async def _refill_uuid_queue():
+    """Пополняет пул UUID4 пачками, ожидая, пока в очереди освободится место"""
+    while True:
+        buf = os.urandom(16 * UUID_BATCH_SIZE)
+        for i in range(UUID_BATCH_SIZE):
+            await uuid_queue.put(uuid.UUID(bytes=buf[i * 16:(i + 1) * 16], version=4).hex)
+
+def next_uuid() -> str:
+    """Возвращает UUID4 из пула, а если пул пуст, генерирует его напрямую"""
+    if uuid_queue is not None:
+        try:
+            return uuid_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    return uuid.uuid4().hex
 
 # Инициализация Telegram бота
 telegram_bot = None
+telegram_queue = None
+
+async def _collect_telegram_batch(first: tuple):
+    """Склеивает сообщения в один чат, пришедшие в течение TELEGRAM_BATCH_WINDOW.
+
+    Возвращает chat_id, общий текст, число сообщений в пачке и сообщение,
+    которое не вошло в пачку (или None).
+    """
+    chat_id, text = first
+    texts = [text]
+    length = len(text)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + TELEGRAM_BATCH_WINDOW
+    while len(texts) < TELEGRAM_BATCH_SIZE:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            item = await asyncio.wait_for(telegram_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            break
+        item_chat_id, item_text = item
+        length += len(TELEGRAM_BATCH_SEPARATOR) + len(item_text)
+        if item_chat_id != chat_id or length > TELEGRAM_MAX_MESSAGE_LENGTH:
+            return chat_id, TELEGRAM_BATCH_SEPARATOR.join(texts), len(texts), item
+        texts.append(item_text)
+    return chat_id, TELEGRAM_BATCH_SEPARATOR.join(texts), len(texts), None
+
+async def _send_telegram_message(chat_id: str, text: str):
+    """Отправляет сообщение, дожидаясь доступности Telegram и соблюдая RetryAfter.
+
+    Бот инициализируется при первой отправке, а не при запуске приложения, чтобы
+    кратковременная недоступность Telegram не отключала уведомления до перезапуска.
+    """
+    delay = 1
+    while True:
+        try:
+            await telegram_bot.initialize()
+            await telegram_bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                parse_mode='HTML'
+            )
+            return
+        except RetryAfter as e:
+            logger.warning("Telegram rate limit hit, retrying in %ss", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except BadRequest:
+            raise
+        except NetworkError as e:
+            logger.warning("Telegram is unavailable, retrying in %ss: %s", delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, TELEGRAM_MAX_BACKOFF)
+
+async def _drain_telegram_queue():
+    """Отправляет сообщения из очереди пачками, соблюдая лимиты Telegram"""
+    pending = None
+    while True:
+        if pending is None:
+            pending = await telegram_queue.get()
+        chat_id, text, count, pending = await _collect_telegram_batch(pending)
+        try:
+            await _send_telegram_message(chat_id, text)
+        except Exception as e:
+            logger.error("Failed to send Telegram notification: %s", e)
+        finally:
+            # task_done только после отправки, чтобы queue.join() при остановке её дожидался
+            for _ in range(count):
+                telegram_queue.task_done()
+        await asyncio.sleep(TELEGRAM_SEND_INTERVAL)
+
+async def notify_telegram(text: str):
+    """Ставит сообщение в очередь на отправку в Telegram, не дожидаясь ответа API"""
+    if telegram_bot:
+        await telegram_queue.put((TELEGRAM_CHAT_ID, text))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Инициализация при запуске
-    global telegram_bot
+    global telegram_bot, telegram_queue, uuid_queue
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_migrate_orders_schema)
+
+    uuid_queue = asyncio.Queue(maxsize=UUID_BATCH_SIZE)
+    uuid_refiller = asyncio.create_task(_refill_uuid_queue())
+
+    telegram_drainer = None
     try:
-        telegram_bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        logger.info("Telegram bot initialized successfully")
+        # Бот создается без обращения к API; соединение устанавливается при первой отправке
+        telegram_bot = Bot(
+            token=TELEGRAM_BOT_TOKEN,
+            request=HTTPXRequest(connection_pool_size=20, connect_timeout=5.0)
+        )
+        telegram_queue = asyncio.Queue()
+        telegram_drainer = asyncio.create_task(_drain_telegram_queue())
+        logger.info("Telegram bot configured")
     except Exception as e:
-        logger.error(f"Failed to initialize Telegram bot: {e}")
+        logger.error("Failed to initialize Telegram bot: %s", e)
         telegram_bot = None
+
+    # Асинхронный HTTP-клиент ЮKassa с keep-alive, чтобы не блокировать event loop
+    app.state.http = None
+    if YOOKASSA_SHOP_ID and YOOKASSA_API_KEY:
+        app.state.http = httpx.AsyncClient(
+            base_url=YOOKASSA_API_URL,
+            auth=(YOOKASSA_SHOP_ID, YOOKASSA_API_KEY),
+            timeout=10.0,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        )
+    else:
+        logger.error("YOOKASSA_SHOP_ID or YOOKASSA_API_KEY is not set, payments are disabled")
     
     yield
     
-    # Очистка при завершении
+    if app.state.http:
+        await app.state.http.aclose()
+
+    uuid_refiller.cancel()
+    await engine.dispose()
+
+    # Очистка при завершении: webhook уже ответил ЮKassa, поэтому уведомления
+    # из очереди отправляются до остановки, а не теряются
+    if telegram_drainer:
+        try:
+            await asyncio.wait_for(telegram_queue.join(), TELEGRAM_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(
+                "Telegram queue not drained in %ss, %s notifications dropped",
+                TELEGRAM_SHUTDOWN_TIMEOUT, telegram_queue.qsize()
+            )
+        telegram_drainer.cancel()
     if telegram_bot:
         try:
-            await telegram_bot.close()
+            await telegram_bot.shutdown()
             logger.info("Telegram bot closed successfully")
         except Exception as e:
-            logger.error(f"Error closing Telegram bot: {e}")
+            logger.error("Error closing Telegram bot: %s", e)
 
 app = FastAPI(
     title="FastAPI Order API",
     description="API для обработки заказов с интеграцией ЮKassa",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Настройка CORS
@@ -156,13 +392,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(SQLAlchemyError)
+async def sqlalchemy_exception_handler(request: Request, exc: SQLAlchemyError):
+    logger.exception("Database error on %s", request.url.path)
+    return JSONResponse(status_code=500, content={"detail": "Database error"})
+
+@app.exception_handler(httpx.HTTPError)
+async def yookassa_exception_handler(request: Request, exc: httpx.HTTPError):
+    logger.error("YooKassa request failed on %s: %s", request.url.path, exc)
+    return JSONResponse(status_code=502, content={"detail": "Payment provider error"})
+
 def is_yookassa_ip(ip: str) -> bool:
     """Проверяет, принадлежит ли IP-адрес ЮKassa"""
     try:
         ip_obj = ipaddress.ip_address(ip)
-        return any(ip_obj in network for network in YOOKASSA_IPS)
     except ValueError:
         return False
+    ip_int = int(ip_obj)
+    ranges = _YOOKASSA_RANGES[ip_obj.version]
+    i = bisect.bisect_right(_YOOKASSA_RANGE_STARTS[ip_obj.version], ip_int) - 1
+    return i >= 0 and ranges[i][1] >= ip_int
+
+async def verify_yookassa_ip(request: Request):
+    """Dependency: отклоняет запросы не с IP-адресов ЮKassa до чтения тела"""
+    client_ip = request.client.host
+    if not is_yookassa_ip(client_ip):
+        logger.warning("Received webhook from unauthorized IP: %s", client_ip)
+        raise HTTPException(status_code=403, detail="Unauthorized IP")
 
 @app.get("/")
 async def root():
@@ -174,141 +430,146 @@ async def root():
         "port": PORT
     }
 
+async def yookassa_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Запрос к ЮKassa с повтором при 5xx.
+
+    Транспорт httpx повторяет только ошибки соединения; повтор после ответа 5xx
+    безопасен: GET идемпотентен, а платежи создаются с Idempotence-Key.
+    """
+    if app.state.http is None:
+        raise HTTPException(status_code=503, detail="Payment provider is not configured")
+    for attempt in range(YOOKASSA_MAX_RETRIES + 1):
+        resp = await app.state.http.request(method, url, **kwargs)
+        if resp.status_code not in YOOKASSA_RETRY_STATUSES or attempt == YOOKASSA_MAX_RETRIES:
+            break
+        logger.warning("YooKassa returned %s, retrying", resp.status_code)
+        await asyncio.sleep(YOOKASSA_BACKOFF_FACTOR * 2 ** attempt)
+    resp.raise_for_status()
+    return resp
+
 @app.post("/order")
-async def create_order(order: OrderCreate, db: Session = Depends(get_db)):
-    try:
-        # Преобразуем items в список словарей
-        items_data = [item.dict() for item in order.items]
-        
-        # Создание заказа в базе данных
-        db_order = Order(
-            email=order.email,
-            phone=order.phone,
-            address=order.address,
-            delivery_time=order.delivery_time,
-            order_time=order.order_time,
-            items=items_data,
-            total_amount=order.total_amount
-        )
-        db.add(db_order)
-        db.commit()
-        db.refresh(db_order)
-
-        # Создание платежа в ЮKassa
-        idempotence_key = str(uuid.uuid4())
-        payment_data = {
-            "amount": {
-                "value": str(order.total_amount),
-                "currency": "RUB"
-            },
-            "confirmation": {
-                "type": "embedded"  # Изменено на embedded для виджета
-            },
-            "capture": True,
-            "description": f"Заказ №{db_order.id}"
-        }
-
-        payment = yookassa.Payment.create(payment_data, idempotence_key)
-
-        # Обновление заказа с ID платежа
-        db_order.payment_id = payment.id
-        db.commit()
-
-        return {
-            "order_id": db_order.id,
-            "confirmation_token": payment.confirmation.confirmation_token
-        }
-    except Exception as e:
-        db.rollback()
-        logger.error(f"Error creating order: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+async def create_order(order: OrderCreate, db: AsyncSession = Depends(get_db)):
+    # Преобразуем items в список словарей
+    items_data = [item.model_dump() for item in order.items]
+    
+    # Создание заказа в базе данных
+    db_order = Order(
+        email=order.email,
+        phone=order.phone,
+        address=order.address,
+        delivery_time=order.delivery_time,
+        order_time=order.order_time,
+        items=items_data,
+        total_amount_kop=order.total_amount_kop
+    )
+    # Заказ фиксируется до обращения к ЮKassa, чтобы не держать блокировку записи
+    # SQLite на время сетевого запроса. Благодаря expire_on_commit=False номер
+    # заказа доступен без повторного SELECT
+    db.add(db_order)
+    await db.commit()
+
+    # Создание платежа в ЮKassa
+    idempotence_key = next_uuid()
+    payment_body = YOOKASSA_PAYMENT_TEMPLATE.format(
+        value=format_kopecks(db_order.total_amount_kop),
+        order_id=db_order.id
+    ).encode()
+
+    resp = await yookassa_request(
+        "POST",
+        "payments",
+        content=payment_body,
+        headers={"Content-Type": "application/json", "Idempotence-Key": idempotence_key}
+    )
+    payment = resp.json()
+
+    # Сохранение заказа вместе с ID платежа
+    db_order.payment_id = payment["id"]
+    await db.commit()
+
+    return {
+        "order_id": db_order.id,
+        "confirmation_token": payment["confirmation"]["confirmation_token"]
+    }
 
-@app.post("/webhook")
-async def yookassa_webhook(request: Request, db: Session = Depends(get_db)):
+@app.post("/webhook", dependencies=[Depends(verify_yookassa_ip)])
+async def yookassa_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+    # Разбор и валидация уведомления за один проход по сырому телу запроса
     try:
-        # Проверка IP-адреса
-        client_ip = request.client.host
-        if not is_yookassa_ip(client_ip):
-            logger.warning(f"Received webhook from unauthorized IP: {client_ip}")
-            raise HTTPException(status_code=403, detail="Unauthorized IP")
-
-        # Получение данных уведомления
-        notification_data = await request.json()
-        notification = YooKassaNotification(**notification_data)
+        notification = YooKassaNotification.model_validate_json(await request.body())
+    except ValidationError as e:
+        logger.warning("Received malformed webhook: %s", e)
+        raise HTTPException(status_code=400, detail="Invalid notification")
+    
+    # Проверка типа уведомления
+    if notification.type != "notification":
+        raise HTTPException(status_code=400, detail="Invalid notification type")
+
+    # Статус заказа обновляется до ответа: при ошибке ЮKassa получит не 2xx
+    # и повторит уведомление. Telegram-уведомление только ставится в очередь
+    payment = notification.object
+    if notification.event == "payment.succeeded":
+        order = await db.scalar(GET_ORDER_BY_PAYMENT, {"pid": payment.id})
         
-        # Проверка типа уведомления
-        if notification.type != "notification":
-            raise HTTPException(status_code=400, detail="Invalid notification type")
-
-        # Обработка различных событий
-        if notification.event == "payment.succeeded":
-            payment = notification.object
-            order = db.query(Order).filter(Order.payment_id == payment["id"]).first()
-            
-            if order:
-                # Проверка статуса платежа через API
-                yookassa_payment = yookassa.Payment.find_one(payment["id"])
-                if yookassa_payment.status == "succeeded":
-                    order.status = "paid"
-                    db.commit()
-
-                    # Формируем подробное сообщение для Telegram
-                    items_text = "\n".join([f"- {item['name']} x{item['quantity']}" for item in order.items])
-                    message = (
-                        f"✅ Оплачен заказ №{order.id}\n\n"
-                        f"💰 Сумма: {order.total_amount} руб.\n"
-                        f"📧 Email: {order.email}\n"
-                        f"📱 Телефон: {order.phone}\n"
-                        f"📍 Адрес: {order.address}\n"
-                        f"🕒 Время доставки: {order.delivery_time}\n\n"
-                        f"📋 Состав заказа:\n{items_text}"
-                    )
-                    
-                    # Отправка уведомления в Telegram
-                    if telegram_bot:
-                        try:
-                            await telegram_bot.send_message(
-                                chat_id=TELEGRAM_CHAT_ID,
-                                text=message,
-                                parse_mode='HTML'
-                            )
-                            logger.info(f"Telegram notification sent for order {order.id}")
-                        except Exception as e:
-                            logger.error(f"Failed to send Telegram notification: {e}")
-
-        elif notification.event == "payment.waiting_for_capture":
-            logger.info(f"Payment {notification.object['id']} waiting for capture")
+        # Уведомление пришло с IP-адреса ЮKassa, поэтому статусу из него доверяем
+        # без повторного запроса платежа через API
+        if order and payment.status == "succeeded":
+            order.status = "paid"
+            await db.commit()
+
+            # Формируем подробное сообщение для Telegram. Поля заполняет покупатель, а сообщения
+            # уходят пачкой с parse_mode='HTML', поэтому один символ '<' или '&' без
+            # экранирования отклонил бы всю пачку
+            items_text = "\n".join(
+                [f"- {html.escape(item['name'])} x{item['quantity']}" for item in order.items]
+            )
+            message = (
+                f"✅ Оплачен заказ №{order.id}\n\n"
+                f"💰 Сумма: {format_kopecks(order.total_amount_kop)} руб.\n"
+                f"📧 Email: {html.escape(order.email)}\n"
+                f"📱 Телефон: {html.escape(order.phone)}\n"
+                f"📍 Адрес: {html.escape(order.address)}\n"
+                f"🕒 Время доставки: {html.escape(order.delivery_time)}\n\n"
+                f"📋 Состав заказа:\n{items_text}"
+            )
             
-        elif notification.event == "payment.canceled":
-            payment = notification.object
-            order = db.query(Order).filter(Order.payment_id == payment["id"]).first()
-            if order:
-                order.status = "canceled"
-                db.commit()
-                logger.info(f"Order {order.id} payment canceled")
+            # Отправка уведомления в Telegram
+            await notify_telegram(message)
+            logger.info("Telegram notification queued for order %s", order.id)
 
-        return {"status": "ok"}
+    elif notification.event == "payment.waiting_for_capture":
+        logger.info("Payment %s waiting for capture", payment.id)
+        
+    elif notification.event == "payment.canceled":
+        order = await db.scalar(GET_ORDER_BY_PAYMENT, {"pid": payment.id})
+        if order:
+            order.status = "canceled"
+            await db.commit()
+            logger.info("Order %s payment canceled", order.id)
 
-    except Exception as e:
-        logger.error(f"Error processing webhook: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "ok"}
 
 @app.get("/order/{order_id}/status")
-async def get_order_status(order_id: int, db: Session = Depends(get_db)):
-    try:
-        order = db.query(Order).filter(Order.id == order_id).first()
-        if not order:
-            raise HTTPException(status_code=404, detail="Заказ не найден")
-        
-        return {
-            "order_id": order.id,
-            "status": order.status,
-            "payment_id": order.payment_id
-        }
-    except Exception as e:
-        logger.error(f"Error getting order status: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+async def get_order_status(order_id: int, db: AsyncSession = Depends(get_db)):
+    order = await db.get(Order, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+    
+    return {
+        "order_id": order.id,
+        "status": order.status,
+        "payment_id": order.payment_id
+    }
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=PORT) 
\ No newline at end of file
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=PORT,
+        # "auto" выбирает uvloop и httptools, если они установлены (uvloop не ставится на Windows)
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
+        access_log=os.getenv("UVICORN_ACCESS_LOG") == "1"
+    ) 
\ No newline at end of file